@@ -4,6 +4,14 @@ import plotly.express as px
 from geopy.distance import geodesic
 import numpy as np
 from datetime import datetime
+import asyncio
+import csv
+import contextlib
+import json
+import math
+import os
+import threading
+import time
 # Inicialização de estado e utilitários para rotas customizáveis, otimização e bloqueios
 if "custom_routes" not in st.session_state:
     st.session_state.custom_routes = {}  # nome -> lista de paradas (dicts com nome/lat/lng)
@@ -208,6 +216,153 @@ def render_block_panel():
                     # abre um modal-like via expander temporário (não nativo) — simplificação:
                     st.session_state.block_to_edit = idx
 
+# Distância haversine em metros (aceita escalares ou arrays numpy, para cálculos em lote)
+def _haversine_m(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(np.radians, (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * 6371008.8 * np.arcsin(np.sqrt(a))
+
+# Junta as rotas custom (session_state) às linhas oficiais, no mesmo formato de linhas_marilia
+def _linhas_com_custom(linhas):
+    todas = dict(linhas)
+    for name, stops in st.session_state.custom_routes.items():
+        if len(stops) >= 2:
+            todas.setdefault(name + " (Custom)", {"paradas": stops, "velocidade_media": 30, "horario_pico": []})
+    return todas
+
+# Cobertura a pé: grade de população (memory-mapped) e áreas de captação das paradas
+RAIOS_CAPTACAO_M = (300, 500)
+if "_cache_captacao" not in st.session_state:
+    st.session_state["_cache_captacao"] = {}  # (grade, lat, lng, raio) -> índices de células da parada
+if "_cache_cobertura" not in st.session_state:
+    st.session_state["_cache_cobertura"] = {}  # (grade, raio, conjunto de paradas) -> resultado de cobertura
+
+def carregar_grade_populacao(caminho):
+    """
+    Abre uma grade de população sem carregá-la na memória (np.load/np.memmap em modo leitura).
+    Formatos: .npy, ou binário cru (.bin/.raw). A georreferência vem de um .json com o mesmo nome:
+    {"lat_norte": ..., "lng_oeste": ..., "celula_graus": ...} (canto superior esquerdo e tamanho da célula);
+    para binário cru também {"linhas": ..., "colunas": ..., "dtype": "float32"}. "nodata" é opcional.
+    """
+    with open(os.path.splitext(caminho)[0] + ".json", encoding="utf-8") as f:
+        meta = json.load(f)
+    campos = ["lat_norte", "lng_oeste", "celula_graus"]
+    if not caminho.lower().endswith(".npy"):
+        campos += ["linhas", "colunas"]
+    for campo in campos:
+        if campo not in meta:
+            raise ValueError(f"Georreferência da grade precisa do campo: {campo}")
+    if caminho.lower().endswith(".npy"):
+        dados = np.load(caminho, mmap_mode="r")
+    else:
+        dados = np.memmap(caminho, dtype=meta.get("dtype", "float32"), mode="r",
+                          shape=(int(meta["linhas"]), int(meta["colunas"])))
+    if dados.ndim != 2:
+        raise ValueError("Grade de população precisa ser bidimensional")
+    return {
+        # chave de cache muda se o arquivo for substituído
+        "chave": (os.path.abspath(caminho), os.path.getmtime(caminho)),
+        "dados": dados,
+        "lat_norte": float(meta["lat_norte"]),
+        "lng_oeste": float(meta["lng_oeste"]),
+        "celula_graus": float(meta["celula_graus"]),
+        "nodata": meta.get("nodata")
+    }
+
+def celulas_captacao(grade, lat, lng, raio_m):
+    """
+    Índices (achatados) das células cujo centro está a até raio_m da parada.
+    A própria grade serve de índice espacial: só a janela ao redor da parada é lida do disco.
+    """
+    cache = st.session_state["_cache_captacao"]
+    chave = (grade["chave"], round(lat, 6), round(lng, 6), raio_m)
+    if chave in cache:
+        return cache[chave]
+    n_lin, n_col = grade["dados"].shape
+    cel = grade["celula_graus"]
+    dlat = raio_m / 111320.0
+    dlng = raio_m / (111320.0 * max(np.cos(np.radians(lat)), 1e-6))
+    l0 = max(0, int(np.floor((grade["lat_norte"] - (lat + dlat)) / cel)))
+    l1 = min(n_lin, int(np.ceil((grade["lat_norte"] - (lat - dlat)) / cel)))
+    c0 = max(0, int(np.floor((lng - dlng - grade["lng_oeste"]) / cel)))
+    c1 = min(n_col, int(np.ceil((lng + dlng - grade["lng_oeste"]) / cel)))
+    if l0 >= l1 or c0 >= c1:
+        idx = np.empty(0, dtype=np.int64)
+    else:
+        lat_c = grade["lat_norte"] - (np.arange(l0, l1) + 0.5) * cel
+        lng_c = grade["lng_oeste"] + (np.arange(c0, c1) + 0.5) * cel
+        dist = _haversine_m(lat_c[:, None], lng_c[None, :], lat, lng)
+        ll, cc = np.nonzero(dist <= raio_m)
+        idx = (ll + l0).astype(np.int64) * n_col + (cc + c0)
+    cache[chave] = idx
+    return idx
+
+def _populacao_celulas(grade, idx):
+    if idx.size == 0:
+        return 0.0
+    n_col = grade["dados"].shape[1]
+    valores = np.array(grade["dados"][idx // n_col, idx % n_col], dtype=np.float64)
+    if grade.get("nodata") is not None:
+        valores[valores == grade["nodata"]] = 0
+    valores[~np.isfinite(valores) | (valores < 0)] = 0
+    return float(valores.sum())
+
+def cobertura_paradas(grade, paradas, raio_m):
+    """
+    População coberta pela união das áreas de captação das paradas (sem contar células duas vezes)
+    e população exclusiva de cada parada (perdida se só ela for removida).
+    Cache por conjunto de paradas: reordenar a linha não recalcula nada.
+    """
+    unicas = {}
+    for p in paradas:
+        unicas.setdefault((round(p["lat"], 6), round(p["lng"], 6)), []).append(p["nome"])
+    chave = (grade["chave"], raio_m, frozenset((c, tuple(n)) for c, n in unicas.items()))
+    cache = st.session_state["_cache_cobertura"]
+    if chave in cache:
+        return cache[chave]
+    por_parada = [celulas_captacao(grade, lat, lng, raio_m) for lat, lng in unicas]
+    if por_parada:
+        todas, contagem = np.unique(np.concatenate(por_parada), return_counts=True)
+    else:
+        todas, contagem = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    exclusiva = {}
+    for nomes, idx in zip(unicas.values(), por_parada):
+        so_dela = idx[contagem[np.searchsorted(todas, idx)] == 1] if idx.size else idx
+        pop = _populacao_celulas(grade, so_dela)
+        for nome in nomes:
+            exclusiva[nome] = round(pop, 1)
+    resultado = {
+        "populacao_coberta": round(_populacao_celulas(grade, todas), 1),
+        "celulas": int(todas.size),
+        "exclusiva_por_parada": exclusiva
+    }
+    cache[chave] = resultado
+    return resultado
+
+def cobertura_por_linha(grade, linhas, raios=RAIOS_CAPTACAO_M):
+    """Registros (para DataFrame) com a população coberta por linha em cada raio de captação"""
+    registros = []
+    for nome, dados in linhas.items():
+        reg = {"Linha": nome, "Paradas": len(dados["paradas"])}
+        for raio in raios:
+            reg[f"População {raio} m"] = cobertura_paradas(grade, dados["paradas"], raio)["populacao_coberta"]
+        registros.append(reg)
+    return registros
+
+def impacto_cobertura(grade, paradas_antes, paradas_depois, raio_m):
+    """Compara a cobertura de uma variante (paradas removidas ou reordenadas) com a linha original"""
+    antes = cobertura_paradas(grade, paradas_antes, raio_m)["populacao_coberta"]
+    depois = cobertura_paradas(grade, paradas_depois, raio_m)["populacao_coberta"]
+    nomes_depois = {p["nome"] for p in paradas_depois}
+    perdida = max(0.0, antes - depois)
+    return {
+        "populacao_antes": antes,
+        "populacao_depois": depois,
+        "populacao_perdida": round(perdida, 1),
+        "perda_pct": round(100 * perdida / antes, 2) if antes > 0 else 0.0,
+        "paradas_removidas": [p["nome"] for p in paradas_antes if p["nome"] not in nomes_depois]
+    }
+
 # Pequena rotina para integrar rotas custom ao dicionário principal, se desejar
 def integrar_rotas_custom_automatico():
     try:
@@ -523,9 +678,28 @@ def gerar_rota_realista(paradas, desvio=0):
                 break
     return pontos_rota
 
-# Função para simular rota com cálculo de distância real
-def simular_rota(paradas, velocidade_media, tipo="Atual"):
-    """Simula uma rota com cálculos realistas"""
+# Cache das rotas simuladas: cada linha/tipo é gerada uma única vez e reaproveitada pela página,
+# pela análise de corredores, pela exportação e pelo map matching (invalidado quando os bloqueios mudam).
+# O reaproveitamento é por rota inteira: trechos compartilhados entre linhas diferentes continuam sendo
+# gerados por cada linha, porque gerar_rota_realista suaviza e desloca a rota como um todo.
+if "_cache_rotas_simuladas" not in st.session_state:
+    st.session_state["_cache_rotas_simuladas"] = {}  # (tipo, paradas) -> (pontos_rota, distância em km)
+    st.session_state["_cache_rotas_bloqueios"] = None
+if "_cache_corredores" not in st.session_state:
+    st.session_state["_cache_corredores"] = (None, None)  # (chave das rotas e parâmetros, resultado)
+
+def _assinatura_bloqueios():
+    return json.dumps(st.session_state.get("blocked_segments", []), sort_keys=True, default=str)
+
+def _geometria_rota(paradas, tipo, guardar_cache=True):
+    assinatura = _assinatura_bloqueios()
+    cache = st.session_state["_cache_rotas_simuladas"]
+    if st.session_state["_cache_rotas_bloqueios"] != assinatura:
+        cache.clear()
+        st.session_state["_cache_rotas_bloqueios"] = assinatura
+    chave = (tipo, tuple((p["nome"], round(p["lat"], 6), round(p["lng"], 6)) for p in paradas))
+    if chave in cache:
+        return cache[chave]
     pontos_rota = gerar_rota_realista(paradas, desvio=0 if tipo != "Alternativa" else 1)
     
     # Calcula distância total (aproximação)
@@ -535,6 +709,14 @@ def simular_rota(paradas, velocidade_media, tipo="Atual"):
             p1 = (pontos_rota[i]["Lat"], pontos_rota[i]["Lon"])
             p2 = (pontos_rota[i+1]["Lat"], pontos_rota[i+1]["Lon"])
             distancia_total += geodesic(p1, p2).km
+    if guardar_cache:
+        cache[chave] = (pontos_rota, distancia_total)
+    return pontos_rota, distancia_total
+
+# Função para simular rota com cálculo de distância real
+def simular_rota(paradas, velocidade_media, tipo="Atual", guardar_cache=True):
+    """Simula uma rota com cálculos realistas (geometria reaproveitada do cache quando disponível)"""
+    pontos_rota, distancia_total = _geometria_rota(paradas, tipo, guardar_cache)
     
     # Ajustes para rota otimizada
     if tipo == "Otimizada":
@@ -550,6 +732,656 @@ def simular_rota(paradas, velocidade_media, tipo="Atual"):
         "tipo": tipo
     }
 
+# Cálculos de desempenho
+def calcular_estatisticas(rota, tipo_onibus):
+    consumo = rota["distancia_km"] / dados_onibus[tipo_onibus]["consumo"]
+    co2 = rota["distancia_km"] * dados_onibus[tipo_onibus]["co2"]
+    custo = rota["distancia_km"] * dados_onibus[tipo_onibus]["custo_km"]
+    
+    return {
+        "combustivel": round(consumo, 2),
+        "co2": round(co2, 2),
+        "custo": round(custo, 2),
+        "velocidade_media": round(rota["distancia_km"] / (rota["tempo_min"] / 60), 2)
+    }
+
+# Corredores: sobreposição entre linhas por hash de células percorridas pelas rotas simuladas
+TAMANHO_CELULA_CORREDOR_M = 40
+ANGULO_MAX_CORREDOR_GRAUS = 30  # trechos vizinhos só contam como mesma rua se forem paralelos
+LACUNA_MAX_CORREDOR_M = 100     # pedaços do mesmo corredor separados por menos que isso são unidos
+
+def _segmentos_quantizados(pontos_mapa, tam_m=TAMANHO_CELULA_CORREDOR_M, lat_ref=None):
+    """
+    Percorre a polilinha em passos de meia célula e devolve [(célula, km, rumo), ...] para cada
+    célula atravessada, com o km percorrido dentro dela e o rumo (vetor unitário leste, norte) de entrada.
+    lat_ref fixa a escala leste-oeste da grade; linhas comparadas entre si devem usar o mesmo valor.
+    """
+    coords = [(p["Lat"], p["Lon"]) for p in pontos_mapa]
+    if lat_ref is None:
+        lat_ref = coords[0][0] if coords else 0.0
+    escala_lng = 111320.0 * np.cos(np.radians(lat_ref))
+    passos_rota = []
+    celula_ant = None
+    for (lat1, lng1), (lat2, lng2) in zip(coords, coords[1:]):
+        comp_m = float(_haversine_m(lat1, lng1, lat2, lng2))
+        if comp_m == 0:
+            continue
+        rumo = ((lng2 - lng1) * escala_lng / comp_m, (lat2 - lat1) * 111320.0 / comp_m)
+        passos = max(1, int(np.ceil(comp_m / (tam_m / 2.0))))
+        for j in range(1, passos + 1):
+            celula = (int(np.floor((lat1 + (lat2 - lat1) * j / passos) * 111320.0 / tam_m)),
+                      int(np.floor((lng1 + (lng2 - lng1) * j / passos) * escala_lng / tam_m)))
+            if celula_ant is None:
+                celula_ant, km_celula, rumo_celula = celula, 0.0, rumo
+            elif celula != celula_ant:
+                passos_rota.append((celula_ant, km_celula, rumo_celula))
+                celula_ant, km_celula, rumo_celula = celula, 0.0, rumo
+            km_celula += comp_m / passos / 1000.0
+    if celula_ant is not None:
+        passos_rota.append((celula_ant, km_celula, rumo_celula))
+    return passos_rota
+
+def analisar_corredores(linhas, viagens_dia=10, tam_m=TAMANHO_CELULA_CORREDOR_M):
+    """
+    Detecta corredores compartilhados na rede inteira a partir das mesmas rotas "Atual" que a página simula.
+    Cada célula vira uma chave de dicionário com uma entrada por linha que passa por ela; um trecho é
+    compartilhado se outra linha passa, em paralelo, na mesma célula ou numa vizinha lateral (tolera o deslocamento
+    lateral que gerar_rota_realista aplica a cada geração). O conjunto de linhas de cada (célula, rumo) é
+    calculado uma única vez e compartilhado por todas as linhas que passam ali, então o custo é linear
+    no total de passos mais o tamanho desses conjuntos.
+    Sentido oposto conta como km compartilhado, mas não como serviço redundante.
+    viagens_dia é o padrão por linha (uma linha pode definir "viagens_dia" própria).
+    Retorna registros por corredor e por linha, prontos para DataFrame. O último resultado fica em cache
+    enquanto as rotas (paradas e bloqueios) e os parâmetros não mudarem.
+    """
+    chave_cache = (
+        _assinatura_bloqueios(), viagens_dia, tam_m,
+        tuple((nome, dados.get("viagens_dia"), tuple((p["nome"], round(p["lat"], 6), round(p["lng"], 6)) for p in dados["paradas"]))
+              for nome, dados in linhas.items())
+    )
+    if st.session_state["_cache_corredores"][0] == chave_cache:
+        return st.session_state["_cache_corredores"][1]
+    resultado = _calcular_corredores(linhas, viagens_dia, tam_m)
+    st.session_state["_cache_corredores"] = (chave_cache, resultado)
+    return resultado
+
+def _calcular_corredores(linhas, viagens_dia, tam_m):
+    cos_min = np.cos(np.radians(ANGULO_MAX_CORREDOR_GRAUS))
+    n_rumos = 24  # faixas de 15 graus
+    passos_linha = {}
+    linhas_por_celula = {}
+    lat_ref = next((d["paradas"][0]["lat"] for d in linhas.values() if d["paradas"]), 0.0)
+    for nome, dados in linhas.items():
+        pontos = simular_rota(dados["paradas"], dados["velocidade_media"], "Atual")["pontos_mapa"]
+        passos = _segmentos_quantizados(pontos, tam_m, lat_ref)
+        passos_linha[nome] = passos
+        for celula, _, rumo in passos:
+            # uma entrada por linha e célula, guardando só rumos não paralelos entre si
+            # (a linha pode cruzar a mesma célula em sentidos ou ruas diferentes)
+            rumos = linhas_por_celula.setdefault(celula, {}).setdefault(nome, [])
+            if all(rumo[0] * r[0] + rumo[1] * r[1] < cos_min for r in rumos):
+                rumos.append(rumo)
+    freq = {nome: dados.get("viagens_dia", viagens_dia) for nome, dados in linhas.items()}
+    ordem = {nome: i for i, nome in enumerate(linhas)}
+
+    # Linhas paralelas na célula e nas vizinhas laterais de cada (célula, faixa de rumo), com o sentido de cada uma;
+    # grupos iguais são internados para que a comparação entre passos seja por identidade
+    grupos_internados = {}
+    vizinhanca = {}
+
+    def grupo_do_passo(celula, rumo):
+        faixa = int(np.floor(np.arctan2(rumo[1], rumo[0]) / (2 * np.pi / n_rumos))) % n_rumos
+        chave = (celula, faixa)
+        if chave not in vizinhanca:
+            angulo = (faixa + 0.5) * 2 * np.pi / n_rumos
+            ux, uy = np.cos(angulo), np.sin(angulo)
+            sentido = {}
+            cy, cx = celula
+            # só as células ao lado (perpendiculares ao rumo): tolera o deslocamento lateral sem
+            # estender a presença de uma linha além do ponto em que ela deixa a rua
+            lat_y, lat_x = int(round(ux)), int(round(-uy))
+            for k in (-1, 0, 1):
+                for outra, rumos in linhas_por_celula.get((cy + k * lat_y, cx + k * lat_x), {}).items():
+                    for vx, vy in rumos:
+                        cosseno = ux * vx + uy * vy
+                        if abs(cosseno) >= cos_min:
+                            sentido[outra] = sentido.get(outra, False) or cosseno > 0
+            linhas_grupo = frozenset(sentido)
+            linhas_grupo = grupos_internados.setdefault(linhas_grupo, linhas_grupo)
+            vizinhanca[chave] = {"linhas": linhas_grupo, "sentido": sentido,
+                                 "dono": min(linhas_grupo, key=ordem.get) if linhas_grupo else None}
+        return vizinhanca[chave]
+
+    grupos_linha = {nome: [grupo_do_passo(celula, rumo) for celula, _, rumo in passos]
+                    for nome, passos in passos_linha.items()}
+
+    # Agrupa passos contíguos com o mesmo conjunto de linhas, unindo pedaços separados por lacunas curtas
+    # (trechos em que só parte das linhas se afasta); cada corredor é emitido apenas ao percorrer a
+    # primeira linha do conjunto, evitando duplicatas
+    corredores = []
+    for nome, passos in passos_linha.items():
+        grupos = grupos_linha[nome]
+        atual = None
+        lacuna_inicio = None
+        lacuna_km = 0.0
+        i = 0
+        while i < len(passos):
+            km = passos[i][1]
+            grupo = grupos[i]
+            if atual is not None:
+                if grupo["linhas"] is atual["linhas"]:
+                    atual["km"] += lacuna_km + km
+                    # o sentido das outras linhas é somado por grupo distinto ao fechar o corredor
+                    atual["km_por_grupo"].setdefault(id(grupo), [grupo, 0.0])[1] += km
+                    lacuna_inicio = None
+                    lacuna_km = 0.0
+                    i += 1
+                    continue
+                if nome in grupo["linhas"] and grupo["linhas"] < atual["linhas"]:
+                    if lacuna_inicio is None:
+                        lacuna_inicio = i
+                    lacuna_km += km
+                    if lacuna_km * 1000 <= LACUNA_MAX_CORREDOR_M:
+                        i += 1
+                        continue
+                # fecha o corredor e reavalia os passos da lacuna como possível início de outro
+                corredores.append(atual)
+                atual = None
+                if lacuna_inicio is not None:
+                    i = lacuna_inicio
+                lacuna_inicio = None
+                lacuna_km = 0.0
+                continue
+            if len(grupo["linhas"]) >= 2 and grupo["dono"] == nome:
+                atual = {"linhas": grupo["linhas"], "km": km, "km_por_grupo": {id(grupo): [grupo, km]}}
+            i += 1
+        if atual is not None:
+            corredores.append(atual)
+
+    registros_corredores = []
+    for c in corredores:
+        dono = min(c["linhas"], key=ordem.get)
+        mesmo_km = {}
+        for grupo, km in c["km_por_grupo"].values():
+            sentido_dono = grupo["sentido"][dono]
+            for outra, sentido in grupo["sentido"].items():
+                if sentido == sentido_dono:
+                    mesmo_km[outra] = mesmo_km.get(outra, 0.0) + km
+        # linhas que percorrem a maior parte do corredor no mesmo sentido da linha de referência
+        mesmo = [n for n in c["linhas"] if n == dono or mesmo_km.get(n, 0.0) >= c["km"] / 2]
+        oposto = [n for n in c["linhas"] if n not in mesmo]
+        # redundância só entre linhas no mesmo sentido (o grupo oposto é avaliado à parte)
+        redundantes = sum(sum(freq[n] for n in grupo) - max(freq[n] for n in grupo) for grupo in (mesmo, oposto) if grupo)
+        registros_corredores.append({
+            "Linhas": " / ".join(sorted(c["linhas"], key=ordem.get)),
+            "Sentido": "mesmo" if not oposto else ("oposto" if len(mesmo) == 1 and len(oposto) == 1 else "misto"),
+            "Extensão (km)": round(c["km"], 3),
+            "Viagens/dia (combinadas)": sum(freq[n] for n in c["linhas"]),
+            "Km redundantes/dia": round(c["km"] * redundantes, 2)
+        })
+
+    registros_linhas = []
+    km_sobrepostos = 0.0
+    for nome, passos in passos_linha.items():
+        total = sum(km for _, km, _ in passos)
+        compartilhado = sum(km for (_, km, _), grupo in zip(passos, grupos_linha[nome]) if len(grupo["linhas"]) >= 2)
+        # cada trecho sobreposto é contado uma vez, pela primeira linha que passa por ele
+        km_sobrepostos += sum(km for (_, km, _), grupo in zip(passos, grupos_linha[nome])
+                              if len(grupo["linhas"]) >= 2 and grupo["dono"] == nome)
+        registros_linhas.append({
+            "Linha": nome,
+            "Extensão (km)": round(total, 2),
+            "Km compartilhados": round(compartilhado, 2),
+            "% compartilhado": round(100 * compartilhado / total, 1) if total > 0 else 0.0
+        })
+    return {
+        "corredores": registros_corredores,
+        "linhas": registros_linhas,
+        "km_sobrepostos": round(km_sobrepostos, 2)
+    }
+
+# Exportação em fluxo da rede (GeoJSON, GTFS shapes.txt e Parquet) para ferramentas de GIS/BI
+TIPOS_ROTA = ("Atual", "Otimizada", "Alternativa")
+FORMATOS_EXPORTACAO = ("geojson", "gtfs", "parquet")
+
+def _iterar_rotas_rede(linhas, tipo_onibus, tipos=TIPOS_ROTA, hora_pico=False):
+    """Gera (linha, rota, estatísticas) uma rota por vez, com os mesmos ajustes de velocidade da página"""
+    for nome, dados in linhas.items():
+        velocidade_linha = dados["velocidade_media"] * (0.7 if hora_pico else 1.0)
+        for tipo in tipos:
+            # não guarda no cache as rotas geradas só para exportar: a memória não cresce com a rede
+            rota = simular_rota(dados["paradas"], velocidade_linha * (0.9 if tipo == "Alternativa" else 1.0), tipo,
+                                guardar_cache=False)
+            yield nome, rota, calcular_estatisticas(rota, tipo_onibus)
+
+def exportar_rede(diretorio, linhas, tipo_onibus, formatos=FORMATOS_EXPORTACAO, tipos=TIPOS_ROTA,
+                  hora_pico=False, tamanho_lote=50000):
+    """
+    Exporta geometria e métricas de todas as linhas escrevendo em fluxo: cada rota é simulada,
+    gravada e descartada, e o Parquet é escrito em lotes de tamanho_lote linhas, então o uso de
+    memória não cresce com o tamanho da rede. Arquivos gerados em diretorio:
+    rotas.geojson, shapes.txt (GTFS), rotas_pontos.parquet e rotas_metricas.parquet.
+    """
+    formatos = set(formatos)
+    if not formatos:
+        raise ValueError("Selecione ao menos um formato de exportação")
+    invalidos = formatos - set(FORMATOS_EXPORTACAO)
+    if invalidos:
+        raise ValueError(f"Formatos de exportação desconhecidos: {', '.join(sorted(invalidos))}")
+    if "parquet" in formatos:
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Exportação Parquet requer o pacote pyarrow") from None
+        schema_pontos = pa.schema([
+            ("linha", pa.string()), ("tipo", pa.string()), ("sequencia", pa.int32()),
+            ("lat", pa.float64()), ("lon", pa.float64()), ("parada", pa.string()), ("tipo_ponto", pa.string())
+        ])
+        schema_metricas = pa.schema([
+            ("linha", pa.string()), ("tipo", pa.string()), ("distancia_km", pa.float64()),
+            ("tempo_min", pa.float64()), ("combustivel", pa.float64()), ("co2", pa.float64()),
+            ("custo", pa.float64()), ("velocidade_media", pa.float64())
+        ])
+    os.makedirs(diretorio, exist_ok=True)
+
+    arquivos = []
+    total_rotas = 0
+    total_pontos = 0
+    with contextlib.ExitStack() as pilha:
+        if "geojson" in formatos:
+            caminho = os.path.join(diretorio, "rotas.geojson")
+            f_geojson = pilha.enter_context(open(caminho, "w", encoding="utf-8"))
+            f_geojson.write('{"type": "FeatureCollection", "features": [\n')
+            arquivos.append(caminho)
+        if "gtfs" in formatos:
+            caminho = os.path.join(diretorio, "shapes.txt")
+            f_shapes = pilha.enter_context(open(caminho, "w", encoding="utf-8", newline=""))
+            escritor_shapes = csv.writer(f_shapes)
+            escritor_shapes.writerow(["shape_id", "shape_pt_lat", "shape_pt_lon", "shape_pt_sequence", "shape_dist_traveled"])
+            arquivos.append(caminho)
+        if "parquet" in formatos:
+            caminho_pontos = os.path.join(diretorio, "rotas_pontos.parquet")
+            caminho_metricas = os.path.join(diretorio, "rotas_metricas.parquet")
+            pq_pontos = pilha.enter_context(pq.ParquetWriter(caminho_pontos, schema_pontos))
+            pq_metricas = pilha.enter_context(pq.ParquetWriter(caminho_metricas, schema_metricas))
+            lote_pontos = {campo: [] for campo in schema_pontos.names}
+            lote_metricas = {campo: [] for campo in schema_metricas.names}
+            arquivos.extend([caminho_pontos, caminho_metricas])
+
+        def descarregar(escritor, lote, schema, forcar=False):
+            if lote[schema.names[0]] and (forcar or len(lote[schema.names[0]]) >= tamanho_lote):
+                escritor.write_table(pa.Table.from_pydict(lote, schema=schema))
+                for valores in lote.values():
+                    valores.clear()
+
+        for nome, rota, stats in _iterar_rotas_rede(linhas, tipo_onibus, tipos, hora_pico):
+            pontos = rota["pontos_mapa"]
+            metricas = {"distancia_km": rota["distancia_km"], "tempo_min": rota["tempo_min"], **stats}
+            if "geojson" in formatos:
+                feature = {
+                    "type": "Feature",
+                    "geometry": {"type": "LineString", "coordinates": [[p["Lon"], p["Lat"]] for p in pontos]},
+                    "properties": {"linha": nome, "tipo": rota["tipo"], **metricas}
+                }
+                f_geojson.write((",\n" if total_rotas else "") + json.dumps(feature, ensure_ascii=False))
+            if "gtfs" in formatos:
+                lats = np.array([p["Lat"] for p in pontos])
+                lngs = np.array([p["Lon"] for p in pontos])
+                dist_km = np.concatenate(([0.0], np.cumsum(_haversine_m(lats[:-1], lngs[:-1], lats[1:], lngs[1:]) / 1000.0)))
+                shape_id = f"{nome} - {rota['tipo']}"
+                escritor_shapes.writerows(
+                    (shape_id, f"{lat:.6f}", f"{lng:.6f}", seq, f"{d:.4f}")
+                    for seq, (lat, lng, d) in enumerate(zip(lats, lngs, dist_km), start=1)
+                )
+            if "parquet" in formatos:
+                for seq, p in enumerate(pontos, start=1):
+                    lote_pontos["linha"].append(nome)
+                    lote_pontos["tipo"].append(rota["tipo"])
+                    lote_pontos["sequencia"].append(seq)
+                    lote_pontos["lat"].append(p["Lat"])
+                    lote_pontos["lon"].append(p["Lon"])
+                    lote_pontos["parada"].append(p["Parada"])
+                    lote_pontos["tipo_ponto"].append(p["Tipo"])
+                    descarregar(pq_pontos, lote_pontos, schema_pontos)
+                lote_metricas["linha"].append(nome)
+                lote_metricas["tipo"].append(rota["tipo"])
+                for campo in schema_metricas.names[2:]:
+                    lote_metricas[campo].append(float(metricas[campo]))
+                descarregar(pq_metricas, lote_metricas, schema_metricas)
+            total_rotas += 1
+            total_pontos += len(pontos)
+
+        if "geojson" in formatos:
+            f_geojson.write("\n]}\n")
+        if "parquet" in formatos:
+            descarregar(pq_pontos, lote_pontos, schema_pontos, forcar=True)
+            descarregar(pq_metricas, lote_metricas, schema_metricas, forcar=True)
+    return {"rotas": total_rotas, "pontos": total_pontos, "arquivos": arquivos}
+
+# Tempo real: replay de pings GPS/AVL, map matching na polilinha simulada e ETA por parada
+TAMANHO_CELULA_GPS_M = 100
+DISTANCIA_MAX_MATCH_M = 150
+VELOCIDADE_MAX_GPS_MS = 25  # ~90 km/h: limita quanto o veículo pode avançar entre dois pings
+FOLGA_RUIDO_GPS_M = 50      # erro de posição do GPS tolerado além do avanço máximo
+TIMEOUT_CONEXAO_GPS_S = 5   # espera máxima para conectar a um feed via socket
+if "gps_estados" not in st.session_state:
+    st.session_state.gps_estados = {}  # veiculo -> estado incremental (linha, segmento, distância, velocidade)
+
+def preparar_linha_gps(pontos_mapa, velocidade_media, tam_m=TAMANHO_CELULA_GPS_M):
+    """
+    Pré-processa pontos_mapa para o map matching: projeção local em metros, distância acumulada,
+    posição de cada parada ao longo da linha e índice espacial (célula -> segmentos).
+    Guarda listas de floats porque o casamento é feito ping a ping.
+    """
+    lat0 = float(np.mean([p["Lat"] for p in pontos_mapa]))
+    lng0 = float(np.mean([p["Lon"] for p in pontos_mapa]))
+    kx = 111320.0 * float(np.cos(np.radians(lat0)))
+    ky = 111320.0
+    xs = [float(p["Lon"] - lng0) * kx for p in pontos_mapa]
+    ys = [float(p["Lat"] - lat0) * ky for p in pontos_mapa]
+    acumulado = [0.0]
+    for i in range(len(pontos_mapa) - 1):
+        acumulado.append(acumulado[-1] + ((xs[i+1] - xs[i]) ** 2 + (ys[i+1] - ys[i]) ** 2) ** 0.5)
+    indice = {}
+    for i in range(len(pontos_mapa) - 1):
+        for cx in range(int(min(xs[i], xs[i+1]) // tam_m), int(max(xs[i], xs[i+1]) // tam_m) + 1):
+            for cy in range(int(min(ys[i], ys[i+1]) // tam_m), int(max(ys[i], ys[i+1]) // tam_m) + 1):
+                indice.setdefault((cx, cy), []).append(i)
+    return {
+        "lat0": lat0, "lng0": lng0, "kx": kx, "ky": ky, "x": xs, "y": ys,
+        "acumulado": acumulado,
+        "paradas": [(p["Parada"], acumulado[i]) for i, p in enumerate(pontos_mapa) if p["Tipo"] == "Parada"],
+        "indice": indice,
+        "tam_m": tam_m,
+        "velocidade_padrao_ms": velocidade_media / 3.6
+    }
+
+def preparar_rede_gps(linhas):
+    """Linhas prontas para map matching, a partir da rota simulada "Atual" de cada uma"""
+    return {
+        nome: preparar_linha_gps(simular_rota(dados["paradas"], dados["velocidade_media"], "Atual")["pontos_mapa"],
+                                 dados["velocidade_media"])
+        for nome, dados in linhas.items()
+    }
+
+def casar_ping(linha_gps, lat, lng, dist_anterior=None, avanco_max_m=None, dist_prevista=None):
+    """
+    Projeta o ping no segmento mais próximo da polilinha consultando só as células vizinhas do índice.
+    Com a posição anterior do veículo, candidatos além de dist_anterior + avanco_max_m são rejeitados
+    e candidatos atrás dela são penalizados pelo recuo, evitando saltos onde a linha repassa pela mesma rua;
+    dist_prevista (posição anterior + velocidade * dt) desempata os dois lados de um retorno.
+    Retorna (segmento, distância ao longo da linha em m, afastamento em m) ou None se fora da linha.
+    """
+    x_ping = (lng - linha_gps["lng0"]) * linha_gps["kx"]
+    y_ping = (lat - linha_gps["lat0"]) * linha_gps["ky"]
+    tam = linha_gps["tam_m"]
+    alcance = int(np.ceil(DISTANCIA_MAX_MATCH_M / tam))
+    cx, cy = int(x_ping // tam), int(y_ping // tam)
+    xs, ys, acumulado = linha_gps["x"], linha_gps["y"], linha_gps["acumulado"]
+    melhor = None
+    vistos = set()
+    for dx in range(-alcance, alcance + 1):
+        for dy in range(-alcance, alcance + 1):
+            for i in linha_gps["indice"].get((cx + dx, cy + dy), ()):
+                if i in vistos:
+                    continue
+                vistos.add(i)
+                sx, sy = xs[i+1] - xs[i], ys[i+1] - ys[i]
+                comp2 = sx * sx + sy * sy
+                t = 0.0 if comp2 == 0 else min(1.0, max(0.0, ((x_ping - xs[i]) * sx + (y_ping - ys[i]) * sy) / comp2))
+                desvio = ((xs[i] + t * sx - x_ping) ** 2 + (ys[i] + t * sy - y_ping) ** 2) ** 0.5
+                if desvio > DISTANCIA_MAX_MATCH_M:
+                    continue
+                dist_m = acumulado[i] + t * comp2 ** 0.5
+                custo = desvio
+                if dist_anterior is not None:
+                    if avanco_max_m is not None and dist_m > dist_anterior + avanco_max_m:
+                        continue
+                    # recuar custa o quanto recua: no retorno de um laço, o trecho já percorrido
+                    # fica geometricamente perto, mas só vence se o ping estiver de fato mais perto dele
+                    custo += max(0.0, dist_anterior - dist_m)
+                if dist_prevista is not None:
+                    custo += 0.5 * abs(dist_m - dist_prevista)
+                if melhor is None or custo < melhor[0]:
+                    melhor = (custo, i, dist_m, desvio)
+    return None if melhor is None else melhor[1:]
+
+def atualizar_veiculo(estados, linhas_gps, ping):
+    """
+    Atualiza o estado incremental do veículo com um ping {"veiculo", "linha", "ts", "lat", "lng"}.
+    A velocidade é uma média móvel exponencial do avanço ao longo da linha.
+    Retorna o estado atualizado ou None se o ping for descartado (linha desconhecida, fora da linha, fora de ordem).
+    """
+    linha_gps = linhas_gps.get(ping["linha"])
+    if linha_gps is None:
+        return None
+    anterior = estados.get(ping["veiculo"])
+    if anterior is not None and anterior["linha"] != ping["linha"]:
+        anterior = None
+    if anterior is not None and ping["ts"] <= anterior["ts"]:
+        return None
+    if anterior is not None:
+        avanco_max = VELOCIDADE_MAX_GPS_MS * (ping["ts"] - anterior["ts"]) + FOLGA_RUIDO_GPS_M
+        dist_prevista = anterior["dist_m"] + anterior["velocidade_ms"] * (ping["ts"] - anterior["ts"])
+        casamento = casar_ping(linha_gps, ping["lat"], ping["lng"], anterior["dist_m"], avanco_max, dist_prevista)
+    else:
+        casamento = casar_ping(linha_gps, ping["lat"], ping["lng"])
+    if casamento is None:
+        return None
+    seg, dist_m, desvio = casamento
+    velocidade = linha_gps["velocidade_padrao_ms"]
+    if anterior is not None:
+        if dist_m < anterior["dist_m"] - 500:
+            anterior = None  # voltou ao início: nova viagem
+        else:
+            dist_m = max(dist_m, anterior["dist_m"])  # ignora pequenos recuos do GPS
+            instantanea = min(VELOCIDADE_MAX_GPS_MS, (dist_m - anterior["dist_m"]) / (ping["ts"] - anterior["ts"]))
+            velocidade = 0.3 * instantanea + 0.7 * anterior["velocidade_ms"]
+    estado = {
+        "linha": ping["linha"], "seg": seg, "dist_m": dist_m, "ts": ping["ts"],
+        "lat": ping["lat"], "lng": ping["lng"], "desvio_m": desvio, "velocidade_ms": velocidade
+    }
+    estados[ping["veiculo"]] = estado
+    return estado
+
+def eta_paradas(linha_gps, estado):
+    """ETA às paradas restantes com base na distância ao longo da linha e na velocidade estimada"""
+    velocidade = max(estado["velocidade_ms"], 1.0)
+    return [
+        {"Parada": nome, "Distância (m)": round(d - estado["dist_m"]), "ETA (min)": round((d - estado["dist_m"]) / velocidade / 60, 1)}
+        for nome, d in linha_gps["paradas"] if d > estado["dist_m"]
+    ]
+
+def _ler_ping(campos):
+    """Converte uma linha CSV veiculo,linha,timestamp,lat,lng (timestamp epoch ou ISO) em ping"""
+    veiculo, linha, ts, lat, lng = [c.strip() for c in campos[:5]]
+    try:
+        ts = float(ts)
+    except ValueError:
+        ts = datetime.fromisoformat(ts).timestamp()
+    lat, lng = float(lat), float(lng)
+    # feeds sem fixo de GPS mandam "nan"; um valor não finito quebraria o map matching e o estado do veículo
+    if not all(math.isfinite(v) for v in (ts, lat, lng)):
+        raise ValueError("Ping com timestamp ou coordenada não finita")
+    return {"veiculo": veiculo, "linha": linha, "ts": ts, "lat": lat, "lng": lng}
+
+async def _produzir_pings(origem, fila, velocidade_replay, tamanho_lote, resumo, parar):
+    """Lê pings de um arquivo CSV ou de um socket "host:porta" e os envia em lotes para a fila até o fim do feed ou parar"""
+    lote = []
+    ts_anterior = None
+
+    async def enviar(ping):
+        nonlocal lote, ts_anterior
+        # velocidade_replay > 0 respeita os intervalos do feed acelerados por esse fator
+        if velocidade_replay > 0 and ts_anterior is not None and ping["ts"] > ts_anterior:
+            if lote:
+                await fila.put(lote)
+                lote = []
+            espera = (ping["ts"] - ts_anterior) / velocidade_replay
+            while espera > 0 and not parar.is_set():
+                await asyncio.sleep(min(espera, 0.2))
+                espera -= 0.2
+        ts_anterior = ping["ts"] if ts_anterior is None else max(ts_anterior, ping["ts"])
+        lote.append(ping)
+        if len(lote) >= tamanho_lote:
+            await fila.put(lote)
+            lote = []
+
+    def interpretar(texto):
+        campos = next(csv.reader([texto]), [])
+        if len(campos) < 5 or campos[0].strip().lower() == "veiculo":
+            return None
+        try:
+            return _ler_ping(campos)
+        except ValueError:
+            resumo["invalidos"] += 1
+            return None
+
+    host, _, porta = origem.rpartition(":")
+    if host and porta.isdigit() and not os.path.exists(origem):
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, int(porta)),
+                                                    timeout=TIMEOUT_CONEXAO_GPS_S)
+        except asyncio.TimeoutError:
+            raise ConnectionError(f"Sem resposta de {origem} em {TIMEOUT_CONEXAO_GPS_S} s") from None
+        try:
+            while not parar.is_set():
+                try:
+                    texto = await asyncio.wait_for(reader.readline(), timeout=0.2)
+                except asyncio.TimeoutError:
+                    # feed parado: entrega o lote parcial para não atrasar as ETAs
+                    if lote:
+                        await fila.put(lote)
+                        lote = []
+                    continue
+                if not texto:
+                    break
+                ping = interpretar(texto.decode("utf-8", errors="replace"))
+                if ping is not None:
+                    await enviar(ping)
+        finally:
+            writer.close()
+    else:
+        with open(origem, encoding="utf-8", newline="") as f:
+            for n, texto in enumerate(f):
+                if parar.is_set():
+                    break
+                ping = interpretar(texto)
+                if ping is not None:
+                    await enviar(ping)
+                if n % tamanho_lote == 0:
+                    await asyncio.sleep(0)  # cede o loop para o consumidor
+    if lote:
+        await fila.put(lote)
+    await fila.put(None)
+
+async def _consumir_pings(fila, linhas_gps, estados, resumo):
+    while True:
+        lote = await fila.get()
+        if lote is None:
+            break
+        for ping in lote:
+            if atualizar_veiculo(estados, linhas_gps, ping) is None:
+                resumo["descartados"] += 1
+            else:
+                resumo["processados"] += 1
+
+async def _pipeline_pings(origem, linhas_gps, estados, velocidade_replay, tamanho_lote, resumo, parar):
+    fila = asyncio.Queue(maxsize=16)  # limita lotes em trânsito (backpressure no produtor)
+    inicio = time.perf_counter()
+    await asyncio.gather(
+        _produzir_pings(origem, fila, velocidade_replay, tamanho_lote, resumo, parar),
+        _consumir_pings(fila, linhas_gps, estados, resumo)
+    )
+    duracao = time.perf_counter() - inicio
+    resumo["segundos"] = round(duracao, 3)
+    resumo["pings_por_segundo"] = round((resumo["processados"] + resumo["descartados"]) / duracao) if duracao > 0 else 0
+    return resumo
+
+def reproduzir_pings(origem, linhas_gps, estados=None, velocidade_replay=0.0, tamanho_lote=1000, resumo=None, parar=None):
+    """
+    Roda o pipeline asyncio (produtor lendo o feed -> consumidor fazendo map matching) até o fim do feed
+    ou até o evento parar ser acionado. estados e resumo são atualizados durante o replay.
+    origem: caminho de CSV (veiculo,linha,timestamp,lat,lng) ou "host:porta" de um replay via socket.
+    Retorna (estados por veículo, resumo com contagens e pings/s).
+    """
+    estados = {} if estados is None else estados
+    resumo = {} if resumo is None else resumo
+    for campo in ("processados", "descartados", "invalidos"):
+        resumo.setdefault(campo, 0)
+    parar = threading.Event() if parar is None else parar
+    asyncio.run(_pipeline_pings(origem, linhas_gps, estados, velocidade_replay, tamanho_lote, resumo, parar))
+    return estados, resumo
+
+def iniciar_replay_pings(origem, linhas_gps, estados, velocidade_replay=0.0, tamanho_lote=1000):
+    """
+    Roda reproduzir_pings numa thread em segundo plano para não bloquear a página (feeds via socket
+    podem não terminar). Retorna {"thread", "parar", "resumo"}; o resumo ganha "erro" se o feed falhar.
+    """
+    parar = threading.Event()
+    resumo = {"processados": 0, "descartados": 0, "invalidos": 0, "inicio": time.perf_counter(), "erro": None}
+
+    def executar():
+        try:
+            reproduzir_pings(origem, linhas_gps, estados, velocidade_replay, tamanho_lote, resumo=resumo, parar=parar)
+        except Exception as e:
+            resumo["erro"] = str(e)
+
+    thread = threading.Thread(target=executar, daemon=True)
+    thread.start()
+    return {"thread": thread, "parar": parar, "resumo": resumo}
+
+# Painel da frota: só este trecho é atualizado periodicamente enquanto o replay de GPS roda
+# (st.fragment), sem recalcular corredores, cobertura e mapas das outras abas
+def _painel_tempo_real():
+    origem_feed = st.text_input("Feed de pings (arquivo CSV veiculo,linha,timestamp,lat,lng ou host:porta):", value="")
+    velocidade_replay = st.number_input("Aceleração do replay (0 = o mais rápido possível)", min_value=0.0, value=0.0, step=1.0)
+    replay = st.session_state.get("gps_replay")
+    replay_ativo = replay is not None and replay["thread"].is_alive()
+    col1, col2 = st.columns(2)
+    if col1.button("Reproduzir feed", disabled=replay_ativo) and origem_feed:
+        # nova rede e estados zerados: posições antigas não valem para outra geometria
+        st.session_state["gps_rede"] = preparar_rede_gps(_linhas_com_custom(linhas_marilia))
+        st.session_state.gps_estados = {}
+        replay = iniciar_replay_pings(
+            origem_feed,
+            st.session_state["gps_rede"],
+            st.session_state.gps_estados,
+            velocidade_replay=velocidade_replay
+        )
+        st.session_state["gps_replay"] = replay
+        replay_ativo = True
+    if col2.button("Parar replay", disabled=not replay_ativo):
+        replay["parar"].set()
+    
+    if replay is not None:
+        resumo_feed = replay["resumo"]
+        if resumo_feed["erro"]:
+            st.error(f"Falha ao ler o feed: {resumo_feed['erro']}")
+        else:
+            lidos = resumo_feed["processados"] + resumo_feed["descartados"]
+            taxa = resumo_feed.get("pings_por_segundo") or round(lidos / max(time.perf_counter() - resumo_feed["inicio"], 1e-6))
+            st.caption(
+                f"{'Replay em andamento' if replay_ativo else 'Replay encerrado'}: "
+                f"{resumo_feed['processados']} pings casados, {resumo_feed['descartados']} descartados ({taxa} pings/s)"
+            )
+    
+    # cópia: o consumidor em segundo plano continua atualizando os estados
+    veiculos_linha = {v: e for v, e in dict(st.session_state.gps_estados).items() if e["linha"] == linha_selecionada}
+    if not veiculos_linha:
+        st.info("Nenhum veículo da linha selecionada no feed.")
+    else:
+        # mesma geometria usada no map matching, para que as distâncias sejam comparáveis
+        linha_gps = st.session_state["gps_rede"][linha_selecionada]
+        st.dataframe(pd.DataFrame([
+            {"Veículo": v, "Percorrido (km)": round(e["dist_m"] / 1000, 2),
+             "Velocidade (km/h)": round(e["velocidade_ms"] * 3.6, 1), "Afastamento da rota (m)": round(e["desvio_m"])}
+            for v, e in veiculos_linha.items()
+        ]).set_index("Veículo"))
+        veiculo_eta = st.selectbox("ETA por parada do veículo:", list(veiculos_linha.keys()))
+        st.dataframe(pd.DataFrame(eta_paradas(linha_gps, veiculos_linha[veiculo_eta])))
+
 # Interface
 with st.sidebar:
     st.image("https://upload.wikimedia.org/wikipedia/commons/thumb/7/7c/Brasao_Marilia.svg/1200px-Brasao_Marilia.svg.png", width=100)
@@ -593,18 +1425,6 @@ if mostrar_alternativa:
     rota_alternativa = simular_rota(dados_linha["paradas"], velocidade * 0.9, "Alternativa")
 
 # Cálculos de desempenho
-def calcular_estatisticas(rota, tipo_onibus):
-    consumo = rota["distancia_km"] / dados_onibus[tipo_onibus]["consumo"]
-    co2 = rota["distancia_km"] * dados_onibus[tipo_onibus]["co2"]
-    custo = rota["distancia_km"] * dados_onibus[tipo_onibus]["custo_km"]
-    
-    return {
-        "combustivel": round(consumo, 2),
-        "co2": round(co2, 2),
-        "custo": round(custo, 2),
-        "velocidade_media": round(rota["distancia_km"] / (rota["tempo_min"] / 60), 2)
-    }
-
 stats_atual = calcular_estatisticas(rota_atual, tipo_onibus)
 stats_otimizada = calcular_estatisticas(rota_otimizada, tipo_onibus)
 
@@ -612,7 +1432,7 @@ if mostrar_alternativa:
     stats_alternativa = calcular_estatisticas(rota_alternativa, tipo_onibus)
 
 # Visualização
-tab1, tab2, tab3 = st.tabs(["📊 Comparação", "🌍 Mapa Interativo", "📈 Relatório"])
+tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(["📊 Comparação", "🌍 Mapa Interativo", "📈 Relatório", "👥 Cobertura", "🛣️ Corredores", "📡 Tempo Real"])
 
 with tab1:
     st.subheader("Comparação de Desempenho")
@@ -735,5 +1555,85 @@ with tab3:
         st.metric("Economia Financeira", f"R$ {economia['Custo']:.2f}")
         st.metric("Tempo Economizado", f"{economia['Tempo']:.1f} horas")
 
+
+with tab4:
+    st.subheader("Cobertura da População (captação a pé)")
+    
+    caminho_grade = st.text_input("Grade de população local (.npy ou .bin, com .json de georreferência):", value="")
+    grade_pop = None
+    if caminho_grade:
+        try:
+            grade_pop = carregar_grade_populacao(caminho_grade)
+        except Exception as e:
+            st.error(f"Não foi possível abrir a grade de população: {e}")
+    else:
+        st.info("Informe o caminho de uma grade de população para calcular a cobertura das paradas.")
+    
+    if grade_pop is not None:
+        df_cobertura = pd.DataFrame(cobertura_por_linha(grade_pop, _linhas_com_custom(linhas_marilia)))
+        st.dataframe(df_cobertura.set_index("Linha"))
+        
+        removidas = st.multiselect(
+            "Simular remoção de paradas da linha selecionada:",
+            [p["nome"] for p in dados_linha["paradas"]]
+        )
+        paradas_variante = [p for p in dados_linha["paradas"] if p["nome"] not in removidas]
+        cols_cob = st.columns(len(RAIOS_CAPTACAO_M))
+        for col, raio in zip(cols_cob, RAIOS_CAPTACAO_M):
+            impacto = impacto_cobertura(grade_pop, dados_linha["paradas"], paradas_variante, raio)
+            col.metric(
+                f"População atendida ({raio} m)",
+                f"{impacto['populacao_depois']:.0f}",
+                f"-{impacto['populacao_perdida']:.0f} ({impacto['perda_pct']}%)" if impacto["populacao_perdida"] > 0 else None,
+                delta_color="normal"
+            )
+        
+        exclusiva = cobertura_paradas(grade_pop, dados_linha["paradas"], RAIOS_CAPTACAO_M[0])["exclusiva_por_parada"]
+        st.write(f"População atendida somente por cada parada ({RAIOS_CAPTACAO_M[0]} m):")
+        st.dataframe(pd.DataFrame(
+            [{"Parada": nome, "População exclusiva": pop} for nome, pop in exclusiva.items()]
+        ).set_index("Parada"))
+
+
+with tab5:
+    st.subheader("Corredores Compartilhados")
+    
+    analise = analisar_corredores(_linhas_com_custom(linhas_marilia), viagens_dia=viagens_dia)
+    total_redundante = sum(c["Km redundantes/dia"] for c in analise["corredores"])
+    col1, col2 = st.columns(2)
+    col1.metric("Extensão sobreposta na rede", f"{analise['km_sobrepostos']:.2f} km")
+    col2.metric("Serviço redundante", f"{total_redundante:.1f} km/dia")
+    
+    if analise["corredores"]:
+        st.dataframe(pd.DataFrame(analise["corredores"]))
+    else:
+        st.info("Nenhum corredor compartilhado entre linhas.")
+    st.dataframe(pd.DataFrame(analise["linhas"]).set_index("Linha"))
+
+
+with st.sidebar.expander("📦 Exportar rede"):
+    dir_exportacao = st.text_input("Diretório de saída:", value="exportacao")
+    formatos_exportacao = st.multiselect("Formatos:", list(FORMATOS_EXPORTACAO), default=list(FORMATOS_EXPORTACAO))
+    if st.button("Exportar todas as linhas"):
+        try:
+            resumo = exportar_rede(dir_exportacao, _linhas_com_custom(linhas_marilia), tipo_onibus,
+                                   formatos=formatos_exportacao, hora_pico=hora_pico)
+            st.success(f"{resumo['rotas']} rotas ({resumo['pontos']} pontos) exportadas")
+            for caminho in resumo["arquivos"]:
+                st.write(caminho)
+        except Exception as e:
+            st.error(f"Falha na exportação: {e}")
+
+
+with tab6:
+    st.subheader("Frota em Tempo Real (replay GPS/AVL)")
+    fragmento = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+    if fragmento is not None:
+        fragmento(run_every=1)(_painel_tempo_real)()
+    else:
+        # Streamlit sem fragmentos: sem atualização automática, atualiza ao interagir com a página
+        _painel_tempo_real()
+        st.button("🔄 Atualizar frota")
+
 st.markdown("---")
-st.caption(f"Atualizado em: {datetime.now().strftime('%d/%m/%Y %H:%M')} | Versão 3.0")
\ No newline at end of file
+st.caption(f"Atualizado em: {datetime.now().strftime('%d/%m/%Y %H:%M')} | Versão 3.0")